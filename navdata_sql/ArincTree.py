@@ -1,4 +1,12 @@
+from collections import defaultdict
+from collections.abc import Mapping
 from decimal import Decimal
+from operator import itemgetter
+import re
+from typing import Optional
+
+# Set to True to print the offending field and record when a field fails to render
+debug_render_errors = False
 
 approach_code_to_name = {
     "B": "LOC/DME BC",
@@ -18,107 +26,122 @@ approach_code_to_name = {
 }
 
 
-def lstrip(v, chars):
-    n = 0
-    size = len(v)
-    while v[n] in chars:
-        n += 1
-        if n == size - 1:
-            break
-    v = v[n:]
-
-    return v
-
-
 class Field(object):
     def __init__(self, name, begin, end):
         self.name = name
         self.begin = begin
         self.end = end
+        self._slice = slice(begin, end)
 
     def render_impl(self, text):
-        return text[self.begin:self.end]
+        return text[self._slice]
 
     def render(self, text):
-        try:
-            return self.render_impl(text)
-        except:
-            print(f"Failed to call render on field '{self.name}' whose value was '{text[self.begin:self.end]}'")
+        return self.render_impl(text)
+
+    def report_render_error(self, text, e):
+        if debug_render_errors:
+            print(f"Failed to call render on field '{self.name}' whose value was '{text[self._slice]}': {e}")
             print(f"Whole record: {text}")
-            raise
 
 
 area_code_field = Field("area_code", 1, 4)
 
 
+# hemisphere -> (sign, end of the degrees digits)
+# Latitudes have 2 digits of degrees, longitudes have 3
+_hemispheres = {
+    "N": (1, 3),
+    "S": (-1, 3),
+    "E": (1, 4),
+    "W": (-1, 4)
+}
+
+
 class FieldLatLng(Field):
-    def render_impl(self, text):
+    # The module globals are bound as default arguments so they are local lookups in this hot function
+    def render_impl(self, text, _hemispheres=_hemispheres, _Decimal=Decimal):
         """Convert lat or lng in deg/min/sec to decimal, or none if there is no valid coordinate"""
-        text = text[self.begin:self.end]
+        value = text[self._slice]
 
-        if text[0] == " ":
-            return None
+        try:
+            # Empty if the record is shorter than the field
+            hemisphere = value[0]
+            if hemisphere == " ":
+                return None
 
-        if text[0] == "N" or text[0] == "E":
-            mult = 1
-        else:
-            mult = -1
+            mult, deg_end = _hemispheres.get(hemisphere, (-1, 4))
 
-        if text[0] == "N" or text[0] == "S":
-            dec = Decimal(text[1:3]) + Decimal(text[3:5]) / 60 + Decimal(text[5:7]) / (60 * 60) + Decimal(text[7:9]) / (60 * 60 * 100)
-        else:
-            dec = Decimal(text[1:4]) + Decimal(text[4:6]) / 60 + Decimal(text[6:8]) / (60 * 60) + Decimal(text[8:10]) / (60 * 60 * 100)
+            # DDMMSSss or DDDMMSSss, parsed in one go
+            raw = int(value[1:deg_end + 6])
+        except (ValueError, IndexError) as e:
+            self.report_render_error(text, e)
+            raise
+        # Total in hundredths of a second of arc
+        total = ((raw // 1000000 * 60 + raw // 10000 % 100) * 60 + raw // 100 % 100) * 100 + raw % 100
+
+        # Round to the nearest millionth of a degree: total * 10^6 / 360000 = total * 25 / 9,
+        # which can never fall exactly halfway between two millionths
+        micro = (total * 50 + 9) // 18
 
-        return dec.quantize(Decimal("0.000001")) * mult
+        return _Decimal(micro).scaleb(-6) * mult
 
 
 class FieldSpacePadded(Field):
     def render_impl(self, text):
-        spaces = 0
-        while True:
-            testidx = self.end - (1 + spaces)
-            if testidx < self.begin:
-                break
-            if text[testidx] != ' ':
-                break
-            spaces += 1
-        return text[self.begin: self.end - spaces]
+        return text[self._slice].rstrip(" ")
+
+
+class FieldZeroPaddedUnsigned(Field):
+    """Zero padded number that is never negative, e.g. a length"""
+    def render_impl(self, text):
+        try:
+            return int(text[self._slice].lstrip("0") or "0")
+        except ValueError as e:
+            self.report_render_error(text, e)
+            raise
 
 
 class FieldZeroPadded(Field):
+    """Zero padded number that may be negative, e.g. an elevation"""
     def render_impl(self, text):
+        out = text[self._slice]
         try:
-            out = super(FieldZeroPadded, self).render_impl(text)
             if out[0] == "-":
-                # This returns memory not from the original buf
-                return "-" + lstrip(out[1:], ["0"])
-            # This returns the memory in place
-            return int(lstrip(out, ["0"]))
-        except:
-            print(f"Failure to extract chars {self.begin} {self.end} from {text}")
+                # Keep a single zero if the value is all zeroes
+                return "-" + (out[1:].lstrip("0") or "0")
+            return int(out.lstrip("0") or "0")
+        except (ValueError, IndexError) as e:
+            self.report_render_error(text, e)
             raise
 
 
 class Record(object):
-    def __init__(self, klass, text):
+    # There is one of these per line of the ARINC file, so avoid a __dict__ per instance
+    __slots__ = ("text", "_klass", "_auxiliary_record", "_index")
+
+    def __init__(self, klass, text, index=None):
         self.text = text
         self._klass = klass
         self._auxiliary_record = None
+        # Position of this instance in the storage of its class, if it is stored there
+        self._index = index
 
     def name(self):
         return self._klass.name(self)
 
     def __repr__(self):
-        vals = ""
-        for n, f in self._klass._fields.items():
-            vals = vals + ("{0}={1}, ".format(n, f.render(self.text)))
-        vals = vals[0:-2]
+        klass = self._klass
+        text = self.text
+        aux = self._auxiliary_record
 
-        if self._auxiliary_record is not None:
-            for n, f in self._auxiliary_record._klass._fields.items():
-                vals = vals + ("{0}={1}, ".format(n, f.render(self.text)))
-        applicable_name = self.name()
-        return "{0}[{1}] {{ {2} }}".format(self._klass.label(), applicable_name, vals)
+        vals = klass._repr_format.format(*klass.parse_all(text).values())
+
+        if aux is not None:
+            aux_klass = aux._klass
+            vals = vals + aux_klass._repr_auxiliary_format.format(*aux_klass.parse_all(text).values())
+        applicable_name = klass.name(self)
+        return "{0}[{1}] {{ {2} }}".format(klass.label(), applicable_name, vals)
 
     def get(self, attrib):
         val = self._klass.get(self, attrib)
@@ -132,9 +155,45 @@ class Record(object):
 
         return None
 
+    def as_dict(self):
+        """
+        Returns a name -> value dict of all the fields of this record and of its auxiliary record,
+        giving the same values as get() would for each name
+        """
+        aux = self._auxiliary_record
+        if aux is None:
+            return self._klass.parse_all(self.text)
+
+        values = aux._klass.parse_all(aux.text)
+        for n, v in self._klass.parse_all(self.text).items():
+            # Our own value wins, unless there is none
+            if v is not None or n not in values:
+                values[n] = v
+        return values
+
     def add_auxiliary_instance(self, subclass, instance):
         """For this record instance, member of a parent class, register an instance of a child class under its local_name"""
         self._auxiliary_record = instance
+        if self._index is not None:
+            self._klass._instance_auxiliaries[self._index] = instance
+
+
+class RecordInstances(Mapping):
+    """
+    Read-only name -> Record view of the instances of a class. The records are created when
+    accessed, from the text stored by the class.
+    """
+    def __init__(self, klass):
+        self._klass = klass
+
+    def __getitem__(self, name):
+        return self._klass.get_instance(self._klass._instance_index[name])
+
+    def __iter__(self):
+        return iter(self._klass._instance_index)
+
+    def __len__(self):
+        return len(self._klass._instance_index)
 
 
 class RecordClass(object):
@@ -166,14 +225,20 @@ class RecordClass(object):
         self._value = value_parents_key_field
 
         # value -> count map of unknown values seen for this class' key
-        self._unknown_values = {}
+        self._unknown_values = defaultdict(int)
         # continuation_no -> count of unused continuation records
-        self._unused_continuations = {}
+        self._unused_continuations = defaultdict(int)
 
         # A name -> object map of the child classes of this class
         self._child_classes = {}
-
-        self._instances = {}
+        # A label -> object map of the same child classes
+        self._children_by_label = {}
+
+        # Instances are stored as columns rather than as Record objects, see get_instance()
+        # name -> index in the lists below
+        self._instance_index = {}
+        self._instance_texts = []
+        self._instance_auxiliaries = []
         if parent is not None:
             parent.add_child(self, value_parents_key_field)
         self._parent = parent
@@ -193,9 +258,28 @@ class RecordClass(object):
         else:
             self._name_field = None
 
+        # text -> name of the instance, specialized for a single field or a tuple of fields
+        if self._name_field is None:
+            self._name_renderer = None
+        elif type(self._name_field) is list:
+            renderers = [f.render_impl for f in self._name_field]
+            self._name_renderer = lambda text: tuple([r(text) for r in renderers])
+        else:
+            self._name_renderer = self._name_field.render_impl
+
         self._continuation_record_field = self._fields.get("continuation_record_no")
 
+        # Templates for Record.__repr__, for a record of this class and for one used as an auxiliary record
+        self._repr_format = ", ".join(n + "={}" for n in self._fields)
+        self._repr_auxiliary_format = "".join(n + "={}, " for n in self._fields)
+
         self._required_auxiliary_record_cls = required_auxiliary_record_cls
+        # Resolved from the label above on first use, since children are added after construction
+        self._auxiliary_record_cls = None
+
+        # Compiled on first use by parse_all()
+        self._record_pattern = None
+        self._record_pattern_fields = None
 
     def __repr__(self) -> None:
         return f"RecordClass ({self.label()})"
@@ -205,97 +289,135 @@ class RecordClass(object):
 
     def add_child(self, child, value):
         self._child_classes[value] = child
+        self._children_by_label[child.label()] = child
 
     def parse(self, parent_inst, text):
         """
         Processes a record, going down into class hierarchy to find the most specialized class,
         and adds the record to the class as an instance.
         """
+        existing_instance = self.add_instance(parent_inst, text)
+        if existing_instance is None:
+            return None
 
-        # First we create an object of this class
-        r = Record(self, text)
+        child_class = self.child_class_for(text)
+        if child_class is None:
+            if self._key is not None:
+                self.add_unknown_value(self._key.render(text))
+            return existing_instance
 
-        existing_instance = r
+        # Found the child class, move down in hierarchy
+        return child_class.parse(existing_instance, text)
+
+    # The module globals are bound as default arguments so they are local lookups in this hot function
+    def add_instance(self, parent_inst, text, _Record=Record, _area_code=area_code_field._slice):
+        """
+        Adds a record to this class only, without going down into the class hierarchy.
+
+        Returns the instance that records of the child classes relate to, which is an already
+        known instance of the same name if there is one, or None if the record is not of interest.
+        """
+
+        # This runs for every class level of every line, so keep the attributes in locals
+        cont_field = self._continuation_record_field
+        name_renderer = self._name_renderer
 
         # Currently don't support continuation records
         # If the record has a continuation_record field, make sure it's 0 or 1
         # FIXME: this is a hacky, not well encapsulated way to do this.
         # In the future we want to provide continuation-record-specific field lists
-        cont_rec_mem = None
-        if self._continuation_record_field is not None:
-            cont_rec_mem = self.get_by_field(r, self._continuation_record_field)
-        if cont_rec_mem is None:
-            pass
-        else:
-            # Hacky exception handling to use this call as a test
-            cont_rec = int(cont_rec_mem)
-            # Primary continuation records have number 0 or 1
-            if cont_rec > 1:
-                self._unused_continuations.setdefault(cont_rec, 0)
+        if cont_field is not None:
+            cont_rec = text[cont_field._slice]
+            # Primary continuation records have number 0 or 1. Compare the character
+            # directly, this runs for most records.
+            if cont_rec and cont_rec not in ("0", "1"):
                 self._unused_continuations[cont_rec] += 1
                 # Not interested
                 return None
 
-        if self._name_field is None:
+        if name_renderer is None:
             # If class defines no name, but still is a child,
             # then it is an auxiliary child, e.g. a class that just extends the
             # parent. It should have a 1:1 relationship with it. E.g. AirportClass
             # and AirportPrimaryRecordClass.
+            existing_instance = _Record(self, text)
             if parent_inst is not None:
-                parent_inst.add_auxiliary_instance(self, r)
+                parent_inst.add_auxiliary_instance(self, existing_instance)
+
+        else:
+            global_instance_name = name_renderer(text)
+            index = self._instance_index.get(global_instance_name)
+            if index is None:
+                index = self._instance_index[global_instance_name] = len(self._instance_texts)
+                self._instance_texts.append(text)
+                self._instance_auxiliaries.append(None)
+                existing_instance = _Record(self, text, index)
+            else:
+                existing_instance = self.get_instance(index)
+                # Compare the raw area code slices directly
+                if existing_instance.text[_area_code] != text[_area_code]:
+                    #print("Area code mismatch between {0} \"{1}\" [{2}] and [{3}]".format(self.label(), global_instance_name, existing_instance.text[_area_code], text[_area_code]))
+                    pass
 
-        elif self._name_field is not None:
-            global_instance_name = r.name()
-            existing_instance = self._instances.setdefault(global_instance_name, existing_instance)
-            a1 = base_record_class.get_by_field(existing_instance, area_code_field)
-            a2 = base_record_class.get_by_field(r, area_code_field)
-            if a1 != a2:
-                #print("Area code mismatch between {0} \"{1}\" [{2}] and [{3}]".format(self.label(), global_instance_name, a1, a2))
-                pass
+        return existing_instance
 
+    def child_class_for(self, text):
+        """
+        Returns the child class a record of this class is to be promoted to, or None if there
+        is none, either because this class has no children or because the key value is unknown
+        """
+        children = self._child_classes
         if self._key is None:
-            # Now try to find a child class to promote it to
-            if len(self._child_classes) == 0:
-                return existing_instance
+            if len(children) == 0:
+                return None
 
             # This is possible. We could get here even with a none key because having child classes with a None key is defined
             # In that case the behavior is to cast to the first child class
-            child_class = next(iter(self._child_classes.values()))
-        else:
-            # we use r here and not existing_instance because if
-            # existing_instance gets overridden, it won't contain the line
-            # we're trying to parse
-            key_value = self.get_by_field(r, self._key)
-
-            child_class = self._child_classes.get(key_value)
-            if child_class is None:
-                # FIXME: Unknown value, should log
-                # print("Unknown value {1} class {0}".format(self.label(), key_value))
-                self._unknown_values.setdefault(key_value, 0)
-                self._unknown_values[key_value] += 1
-                return r
+            return next(iter(children.values()))
 
-        # Found the child class, move down in hierarchy
-        return child_class.parse(existing_instance, text)
+        return children.get(self._key.render(text))
+
+    def add_unknown_value(self, key_value):
+        # FIXME: Unknown value, should log
+        # print("Unknown value {1} class {0}".format(self.label(), key_value))
+        self._unknown_values[key_value] += 1
+
+    def _compile_record_pattern(self):
+        fields = list(self._fields.values())
+        # Fields may overlap, so each one is captured with a lookahead anchored at the start of the record
+        pattern = "".join(f"(?=.{{{f.begin}}}(.{{{f.end - f.begin}}}))" for f in fields)
+        self._record_pattern = re.compile(pattern, re.DOTALL)
+        # Plain fields are used as captured, the others need to be rendered to apply their conversion
+        self._record_pattern_fields = [(f.name, None if type(f) is Field else f) for f in fields]
+
+    def parse_all(self, text):
+        """
+        Render all the fields of this class for a record at once, returning a name -> value dict
+        """
+        if self._record_pattern is None:
+            self._compile_record_pattern()
+
+        m = self._record_pattern.match(text)
+        if m is None:
+            # Record too short for the regex, fall back to rendering one field at a time
+            return {n: f.render(text) for n, f in self._fields.items()}
+
+        return {n: v if f is None else f.render(text) for (n, f), v in zip(self._record_pattern_fields, m.groups())}
 
     def get_field(self, field_name):
-        f = self._fields.get(field_name)
-        if f is not None:
-            return f
-        # otherwise
-        if self._parent is None:
-            return None
-        return self._parent.get_field(field_name)
+        # _fields already includes all the fields of the parent classes
+        return self._fields.get(field_name)
 
     def get_field_multi(self, field_name):
+        fields = self._fields
         if isinstance(field_name, tuple):
-            ret = [self.get_field(f) for f in field_name]
+            ret = [fields.get(f) for f in field_name]
             if None in ret:
                 return None
             else:
                 return ret
         else:
-            return self.get_field(field_name)
+            return fields.get(field_name)
 
     def get_by_field(self, instance, field):
         if type(field) is list:
@@ -311,21 +433,26 @@ class RecordClass(object):
         return self.get_by_field(instance, f)
 
     def name(self, instance):
-        if self._name_field is None:
+        if self._name_renderer is None:
             return None
-        return self.get_by_field(instance, self._name_field)
+        return self._name_renderer(instance.text)
 
     def label(self):
         return self._label
 
     def get_type(self, typ: str):
-        return next(c for c in self._child_classes.values() if c.label() == typ)
+        return self._children_by_label[typ]
 
     def get_types(self):
         return self._child_classes
 
     def instances(self):
-        return self._instances
+        return RecordInstances(self)
+
+    def get_instance(self, index):
+        r = Record(self, self._instance_texts[index], index)
+        r._auxiliary_record = self._instance_auxiliaries[index]
+        return r
 
     def get_fields(self):
         """
@@ -333,8 +460,9 @@ class RecordClass(object):
         and working down to this most-derived class
         """
         if self._required_auxiliary_record_cls is not None:
-            aux_class = next(filter(lambda x: x.label() == self._required_auxiliary_record_cls, self._child_classes.values()))
-            retval = aux_class._fields.values()
+            if self._auxiliary_record_cls is None:
+                self._auxiliary_record_cls = self._children_by_label[self._required_auxiliary_record_cls]
+            retval = self._auxiliary_record_cls._fields.values()
         else:
             retval = self._fields.values()
 
@@ -408,7 +536,7 @@ airport_primary_record_class_fields = [
     FieldSpacePadded("iata_designator", 13, 16),
     Field("continuation_record_number", 21, 22),
     Field("speed_limit_altitude", 22, 27),
-    FieldZeroPadded("longest_runway", 27, 30),
+    FieldZeroPaddedUnsigned("longest_runway", 27, 30),
     Field("ifr_capability", 30, 31),
     Field("longest_runway_surface_code", 31, 32),
     FieldLatLng("latitude", 32, 41),
@@ -424,13 +552,13 @@ airport_primary_record_class = RecordClass("AirportPrimaryRecord", airport_class
 airport_runway_class_fields = [
     FieldSpacePadded("runway_identifier", 13, 18),
     Field("continuation_record_number", 21, 22),
-    FieldZeroPadded("runway_length", 22, 27),
+    FieldZeroPaddedUnsigned("runway_length", 22, 27),
     Field("runway_magnetic_bearing", 27, 31),
     Field("latitude", 32, 41),
     Field("longitude", 41, 51),
     Field("runway_gradient", 51, 56),
     FieldZeroPadded("runway_threshold_elevation", 66, 71),
-    FieldZeroPadded("displaced_threshold", 71, 75),
+    FieldZeroPaddedUnsigned("displaced_threshold", 71, 75),
     Field("threshold_crossing_height", 75, 77),
     Field("runway_width", 77, 80),
     Field("approach_navaid", 81, 85),
@@ -688,9 +816,108 @@ restrictive_airspace_class_fields = [
 restrictive_airspace_class = RecordClass("RestrictiveAirspace", airspace_class, "R", None, restrictive_airspace_class_fields, ("restrictive_type", "airspace_designation", "multiple_code"))
 
 
+def _all_classes(klass):
+    yield klass
+    for child in klass.get_types().values():
+        yield from _all_classes(child)
+
+
+# The values of all the fields used to pick a child class, anywhere in the hierarchy, determine
+# the whole path of classes a record goes through. They are read with a single itemgetter call.
+# These are all one character long, and CPython already shares one-character strings, so
+# interning them wouldn't make the dict lookups any faster.
+_dispatch_key = itemgetter(*[slice(b, e) for b, e in sorted({(k._key.begin, k._key.end) for k in _all_classes(base_record_class) if k._key is not None})])
+
+# classes of interest (None for all of them) -> dispatch key -> (classes a record goes through
+# from the root, whether the last one doesn't know the key value). Paths are truncated to the
+# classes of interest, so each set of them needs its own cache.
+_dispatch_paths_by_filter = {None: {}}
+
+
+def _find_dispatch_path(text, classes_of_interest=None):
+    path = []
+    klass = base_record_class
+    while True:
+        path.append(klass)
+        child_class = klass.child_class_for(text)
+        if child_class is None:
+            unknown = klass._key is not None
+            break
+        klass = child_class
+
+    if classes_of_interest is not None:
+        # Don't go deeper than the deepest class of interest, the records of the classes
+        # below it are never created
+        depth = max((i + 1 for i, k in enumerate(path) if k in classes_of_interest), default=0)
+        if depth < len(path):
+            return path[:depth], False
+
+    return path, unknown
+
+
+def resolve_classes_of_interest(labels):
+    """
+    Turn a set of class labels into the set of classes to parse, which also includes
+    the auxiliary classes those classes require. The result is a frozenset, so that it can
+    key the dispatch path caches.
+    """
+    by_label = {k.label(): k for k in _all_classes(base_record_class)}
+    classes = set()
+    for label in labels:
+        klass = by_label.get(label)
+        if klass is None:
+            raise ValueError(f"Unknown record class '{label}'")
+        classes.add(klass)
+        if klass._required_auxiliary_record_cls is not None:
+            classes.add(by_label[klass._required_auxiliary_record_cls])
+    return frozenset(classes)
+
+
+def parse_record(text, classes_of_interest=None, _dispatch_paths_by_filter=_dispatch_paths_by_filter, _dispatch_key=_dispatch_key):
+    """
+    Same as base_record_class.parse(None, text), but the path down the class hierarchy is
+    looked up once per distinct dispatch key instead of being searched level by level
+
+    classes_of_interest: if not None, a set of classes from resolve_classes_of_interest(); records
+        are only created for these classes and their ancestors.
+    """
+    if classes_of_interest is not None and type(classes_of_interest) is not frozenset:
+        classes_of_interest = frozenset(classes_of_interest)
+    dispatch_paths = _dispatch_paths_by_filter.get(classes_of_interest)
+    if dispatch_paths is None:
+        dispatch_paths = _dispatch_paths_by_filter[classes_of_interest] = {}
+
+    dispatch_key = _dispatch_key(text)
+    path = dispatch_paths.get(dispatch_key)
+    if path is None:
+        path = dispatch_paths[dispatch_key] = _find_dispatch_path(text, classes_of_interest)
+    classes, unknown = path
+
+    instance = None
+    for klass in classes:
+        instance = klass.add_instance(instance, text)
+        if instance is None:
+            return None
+
+    if unknown:
+        klass.add_unknown_value(klass._key.render(text))
+    return instance
+
+
 class ArincFile:
-    def __init__(self, fname: str) -> None:
-        with open(fname, "rb") as f:
+    def __init__(self, fname: str, classes_of_interest: Optional[set[str]] = None) -> None:
+        """
+        classes_of_interest: labels of the record classes to load, e.g. {"Airport", "AirportRunway"}.
+            Records of other classes aren't kept, which saves time and memory when only some
+            classes are needed. By default, everything is loaded.
+        """
+        if classes_of_interest is None:
+            self._classes_of_interest = None
+        else:
+            self._classes_of_interest = resolve_classes_of_interest(classes_of_interest)
+
+        # Decode the whole buffer at once rather than line by line
+        with open(fname, "r", encoding="ascii", buffering=1024 * 1024) as f:
             # Skip some special records
             next(f)
             next(f)
@@ -699,14 +926,12 @@ class ArincFile:
             next(f)
 
             for line in f:
-                line = line[0:-1].decode("ascii")
-
-                self.add_record(line)
+                self.add_record(line.rstrip("\n"))
 
     def add_record(self, text: str) -> None:
         try:
-            base_record_class.parse(None, text)
-        except:
+            parse_record(text, self._classes_of_interest)
+        except Exception:
             print("Error was with line:")
             print(text)
             raise
@@ -1,68 +1,127 @@
 #!/usr/bin/python
 
-from ArincTree import ArincFile, RecordClass
+from ArincTree import ArincFile, RecordClass, FieldLatLng
 from ArincTree import airport_class, airport_runway_class, airport_approach_class, airport_approach_transition_class, airport_approach_waypoint_class, airport_departure_class, airport_departure_transition_class, airport_departure_waypoint_class, airport_arrival_class, airport_arrival_transition_class, airport_arrival_waypoint_class, heliport_class, heliport_approach_class, heliport_approach_transition_class, heliport_approach_waypoint_class, heliport_departure_class, heliport_departure_transition_class, heliport_departure_waypoint_class, heliport_arrival_class, heliport_arrival_transition_class, heliport_arrival_waypoint_class, vhf_navaid_class, ndb_navaid_class, enroute_waypoint_class, enroute_airway_class, airport_waypoint_class, controlled_airspace_class, restrictive_airspace_class, airport_path_point_class
 
+from itertools import chain, islice
+from operator import itemgetter
 import time
 import sqlite3
 import os
-import decimal
 import argparse
-
-
-def sqlite_write_table_for_class(cur, klass: RecordClass):
+from urllib.parse import quote
+
+
+# The classes exported to the database, one table each
+exported_classes = (
+    airport_class,
+    airport_runway_class,
+    airport_approach_class,
+    airport_approach_transition_class,
+    airport_approach_waypoint_class,
+    airport_departure_class,
+    airport_departure_transition_class,
+    airport_departure_waypoint_class,
+    airport_arrival_class,
+    airport_arrival_transition_class,
+    airport_arrival_waypoint_class,
+    heliport_class,
+    heliport_approach_class,
+    heliport_approach_transition_class,
+    heliport_approach_waypoint_class,
+    heliport_departure_class,
+    heliport_departure_transition_class,
+    heliport_departure_waypoint_class,
+    heliport_arrival_class,
+    heliport_arrival_transition_class,
+    heliport_arrival_waypoint_class,
+    vhf_navaid_class,
+    ndb_navaid_class,
+    enroute_waypoint_class,
+    enroute_airway_class,
+    airport_waypoint_class,
+    controlled_airspace_class,
+    restrictive_airspace_class,
+    airport_path_point_class,
+)
+
+
+def sqlite_table_ddl(klass: RecordClass):
+    name_list_str = ",".join(map(lambda x: x.name, klass.get_fields()))
+    return f"CREATE TABLE {klass.label()} ({name_list_str});"
+
+
+def sqlite_write_table_for_class(cur: sqlite3.Cursor, klass: RecordClass):
     fields = klass.get_fields()
-    name_list_str = ",".join(map(lambda x: x.name, fields))
     table_name = klass.label()
-    cur.execute(f"CREATE TABLE {table_name} ({name_list_str})")
 
     question_mark_str = ",".join(["?"] * len(fields))
 
-    for i in klass.instances().values():
-        values = list(map(lambda x: i.get(x.name), fields))
-        cur.execute(f"INSERT INTO {table_name} VALUES({question_mark_str})", values)
-
-
-def write_sqlite(a: ArincFile):
-    try:
-        os.remove(args.output)
-    except (OSError, FileNotFoundError):
-        pass
+    field_names = tuple(f.name for f in fields)
+    # Pulls the whole row out of Record.as_dict() in a single C call
+    row_getter = itemgetter(*field_names)
+    missing_values = dict.fromkeys(field_names)
+    # Coordinates are Decimals, which sqlite3 can't bind. Convert them to text here rather
+    # than through an adapter, which would be a Python callback for every value.
+    decimal_names = [f.name for f in fields if isinstance(f, FieldLatLng)]
+
+    def extract_row(instance):
+        values = instance.as_dict()
+        for n in decimal_names:
+            v = values.get(n)
+            if v is not None:
+                values[n] = str(v)
+        try:
+            return row_getter(values)
+        except KeyError:
+            # e.g. an airport without its primary record
+            return row_getter(missing_values | values)
+
+    rows = map(extract_row, klass.instances().values())
+
+    # Insert many rows per statement, staying under SQLite's historical limit of 999 bound parameters
+    rows_per_insert = max(1, 999 // len(fields))
+    multi_row_sql = f"INSERT INTO {table_name} VALUES " + ",".join([f"({question_mark_str})"] * rows_per_insert)
+    single_row_sql = f"INSERT INTO {table_name} VALUES({question_mark_str})"
+
+    batch = list(islice(rows, rows_per_insert))
+    while len(batch) == rows_per_insert:
+        cur.execute(multi_row_sql, list(chain.from_iterable(batch)))
+        batch = list(islice(rows, rows_per_insert))
+
+    # The rows left over don't fill a whole statement
+    cur.executemany(single_row_sql, batch)
+
+
+def write_sqlite(a: ArincFile, output_path: str):
+    # Also remove the journal files a previous interrupted export may have left behind, so that
+    # they aren't replayed into the new database
+    for path in (output_path, output_path + "-wal", output_path + "-shm"):
+        try:
+            os.remove(path)
+        except (OSError, FileNotFoundError):
+            pass
+
+    # Manage the transaction explicitly so that the whole export, tables and rows, is a single one
+    con = sqlite3.connect(f"file:{quote(output_path)}?mode=rwc", uri=True, isolation_level=None)
+    cur = con.cursor()
+    # We are the only user of this brand new file, so trade durability guarantees for speed while writing it
+    # The page size has to be set while the file is still empty, before switching to WAL
+    for pragma in ("page_size=8192", "journal_mode=WAL", "synchronous=NORMAL", "temp_store=MEMORY", "cache_size=-262144",
+                   "mmap_size=268435456", "locking_mode=EXCLUSIVE"):
+        cur.execute(f"PRAGMA {pragma}")
+    # Create all the tables with a single script, as the start of the transaction
+    cur.executescript("BEGIN;\n" + "\n".join(sqlite_table_ddl(klass) for klass in exported_classes))
+    if not con.in_transaction:
+        raise RuntimeError("the table creation script didn't leave the export transaction open")
 
-    sqlite3.register_adapter(decimal.Decimal, lambda x: str(x))
+    for klass in exported_classes:
+        sqlite_write_table_for_class(cur, klass)
 
-    con = sqlite3.connect(args.output)
-    cur = con.cursor()
-    sqlite_write_table_for_class(cur, airport_class)
-    sqlite_write_table_for_class(cur, airport_runway_class)
-    sqlite_write_table_for_class(cur, airport_approach_class)
-    sqlite_write_table_for_class(cur, airport_approach_transition_class)
-    sqlite_write_table_for_class(cur, airport_approach_waypoint_class)
-    sqlite_write_table_for_class(cur, airport_departure_class)
-    sqlite_write_table_for_class(cur, airport_departure_transition_class)
-    sqlite_write_table_for_class(cur, airport_departure_waypoint_class)
-    sqlite_write_table_for_class(cur, airport_arrival_class)
-    sqlite_write_table_for_class(cur, airport_arrival_transition_class)
-    sqlite_write_table_for_class(cur, airport_arrival_waypoint_class)
-    sqlite_write_table_for_class(cur, heliport_class)
-    sqlite_write_table_for_class(cur, heliport_approach_class)
-    sqlite_write_table_for_class(cur, heliport_approach_transition_class)
-    sqlite_write_table_for_class(cur, heliport_approach_waypoint_class)
-    sqlite_write_table_for_class(cur, heliport_departure_class)
-    sqlite_write_table_for_class(cur, heliport_departure_transition_class)
-    sqlite_write_table_for_class(cur, heliport_departure_waypoint_class)
-    sqlite_write_table_for_class(cur, heliport_arrival_class)
-    sqlite_write_table_for_class(cur, heliport_arrival_transition_class)
-    sqlite_write_table_for_class(cur, heliport_arrival_waypoint_class)
-    sqlite_write_table_for_class(cur, vhf_navaid_class)
-    sqlite_write_table_for_class(cur, ndb_navaid_class)
-    sqlite_write_table_for_class(cur, enroute_waypoint_class)
-    sqlite_write_table_for_class(cur, enroute_airway_class)
-    sqlite_write_table_for_class(cur, airport_waypoint_class)
-    sqlite_write_table_for_class(cur, controlled_airspace_class)
-    sqlite_write_table_for_class(cur, restrictive_airspace_class)
-    sqlite_write_table_for_class(cur, airport_path_point_class)
-    con.commit()
+    cur.execute("COMMIT")
+    # Leave a plain single-file database behind, not one in WAL mode
+    cur.execute("PRAGMA journal_mode=DELETE")
+    con.close()
 
 
 def main():
@@ -80,12 +139,11 @@ def main():
                         action='store')
     parser.add_argument('arinc_file', help="The ARINC file to read and process")
 
-    global args
     args = parser.parse_args()
 
     t1 = time.time()
     a = ArincFile(args.arinc_file)
-    write_sqlite(a)
+    write_sqlite(a, args.output)
     t2 = time.time()
 
     print("Load time: {0}".format(t2 - t1))
@@ -98,4 +156,5 @@ def main():
         IPython.embed()
 
 
-main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import importlib.util
+
+import pytest
+
+import ArincTree
+
+
+def fresh_arinc_tree():
+    """Load a separate copy of ArincTree, so that each load starts from empty record classes"""
+    spec = importlib.util.spec_from_file_location("ArincTree_under_test", ArincTree.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def record(*parts):
+    """Build a 132-column record from (column, value) pairs"""
+    text = [" "] * 132
+    for column, value in parts:
+        text[column:column + len(value)] = value
+    return "".join(text)
+
+
+RECORDS = [
+    record((0, "SUSAP"), (6, "KJFKK6A"), (13, "JFK"), (21, "0"), (27, "146"), (32, "N40382374W073464329"), (56, "00013"), (93, "JOHN F KENNEDY INTL")),
+    record((0, "SUSAP"), (6, "KJFKK6G"), (13, "RW04L"), (21, "0"), (22, "12079"), (66, "00012"), (71, "0000")),
+    record((0, "SUSAP"), (6, "KLGAK6A"), (13, "LGA"), (21, "0"), (27, "070"), (32, "N40464620W073522260"), (56, "00021"), (93, "LAGUARDIA")),
+    record((0, "SUSAEA"), (13, "ALB"), (19, "K6"), (21, "0"), (32, "N42443210W073482940")),
+]
+
+
+def load(tmp_path, filtered_first=None):
+    """
+    Load RECORDS fully, after first parsing them for EnrouteWaypoint only if filtered_first is
+    "file" (through ArincFile) or "record" (through parse_record)
+    """
+    path = tmp_path / "navdata.txt"
+    path.write_text("HDR\n" * 5 + "\n".join(RECORDS) + "\n", encoding="ascii")
+
+    tree = fresh_arinc_tree()
+    if filtered_first == "file":
+        tree.ArincFile(str(path), {"EnrouteWaypoint"})
+    elif filtered_first == "record":
+        classes_of_interest = tree.resolve_classes_of_interest({"EnrouteWaypoint"})
+        for text in RECORDS:
+            tree.parse_record(text, classes_of_interest)
+    tree.ArincFile(str(path))
+
+    return {
+        klass.label(): {name: instance.as_dict() for name, instance in klass.instances().items()}
+        for klass in (tree.airport_class, tree.airport_runway_class, tree.enroute_waypoint_class)
+    }
+
+
+@pytest.mark.parametrize("filtered_first", ["file", "record"])
+def test_filtered_load_does_not_affect_later_full_load(tmp_path, filtered_first):
+    full = load(tmp_path)
+    assert set(full["Airport"]) == {"KJFK", "KLGA"}
+    assert full["Airport"]["KJFK"]["name"] == "JOHN F KENNEDY INTL"
+
+    assert load(tmp_path, filtered_first) == full